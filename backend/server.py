@@ -1,26 +1,50 @@
 import os
 import re
+import time
+import hashlib
+import asyncio
+import functools
+import itertools
+from collections import defaultdict, deque
+from operator import attrgetter
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from pathlib import Path
 from dotenv import load_dotenv
-from typing import List, Optional, Annotated
+from typing import Dict, List, Optional, Tuple, Annotated
 
 # FastAPI / Starlette
-from fastapi import FastAPI, APIRouter, HTTPException, Request, Header
+from fastapi import FastAPI, APIRouter, HTTPException, Request, Header, Depends
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from starlette.middleware.cors import CORSMiddleware
-from ipware import get_client_ip
 
 # MongoDB
 from motor.motor_asyncio import AsyncIOMotorClient
-from motor.core import AgnosticCollection
+from motor.core import AgnosticCollection, AgnosticDatabase
+from pymongo import InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from pymongo.write_concern import WriteConcern
+from bson import Binary
+import numpy as np
+import redis.asyncio as aioredis
+import orjson
+import zstandard as zstd
+
+from cachetools import TTLCache
 
 # Pydantic / Tipagem
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter
 import uuid
+import secrets
 from datetime import datetime, timezone, timedelta 
 
 # Gemini / YT Transcript
-from youtube_transcript_api import YouTubeTranscriptApi
+from youtube_transcript_api import YouTubeTranscriptApi, RequestBlocked, YouTubeRequestFailed
+from youtube_transcript_api.proxies import GenericProxyConfig
+import requests
+from requests.adapters import HTTPAdapter
+from tenacity import retry, stop_after_attempt, wait_exponential_jitter, retry_if_exception_type
 from google import genai
 from google.genai import types
 from google.genai import errors as genai_errors 
@@ -28,6 +52,17 @@ from google.genai import errors as genai_errors
 # Mercado Pago
 import mercadopago
 
+# Configura o logging (antes de qualquer mensagem, para que formato e nível valham desde a importação)
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+# Os registros não usam thread/processo no formato; dispensa a coleta dessas informações
+logging.logThreads = False
+logging.logProcesses = False
+logging.logMultiprocessing = False
+logger = logging.getLogger(__name__)
+
 # --- Configuração Inicial e Variáveis de Ambiente ---
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -35,55 +70,169 @@ load_dotenv(ROOT_DIR / '.env')
 # Variáveis de Configuração de Monetização
 MAX_REQUESTS_PER_HOUR = 5 
 RATE_LIMIT_DURATION_SECONDS = 3600
+RATE_LIMIT_ANALYTICS_TTL_SECONDS = 30 * 86400 # Retenção dos registros de uso em `rate_limits` (só análise)
+REDIS_URL = os.environ.get('REDIS_URL')
+# "redis" e "mongo" compartilham o limite entre os workers do gunicorn; "memory" conta por processo, sem round-trip
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'redis' if REDIS_URL else 'mongo').lower()
 
 # Chaves de Segurança e Pagamento (Lidas de Environment Variables no Vercel)
 PRO_API_KEY = os.environ.get('PRO_API_KEY')
 MP_ACCESS_TOKEN = os.environ.get('MP_ACCESS_TOKEN')
 MP_PRO_ID = os.environ.get('MP_PRO_ID', 'plano-pro-yt-processor') # ID do item a ser cobrado
 DOMAIN_URL = os.environ.get('DOMAIN_URL', 'http://localhost:3000') # Seu domínio real para redirecionamento
+# Quantos proxies reversos confiáveis acrescentam entradas ao X-Forwarded-For (0 = ignora o cabeçalho)
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', '1'))
+CORS_ORIGINS = [origin.strip() for origin in os.environ.get('CORS_ORIGINS', '*').split(',') if origin.strip()]
 
 if not PRO_API_KEY:
-    logging.warning("PRO_API_KEY não configurada. A funcionalidade Pro não será habilitada.")
+    logger.warning("PRO_API_KEY não configurada. A funcionalidade Pro não será habilitada.")
 
 # Inicializa o Mercado Pago SDK
 if MP_ACCESS_TOKEN:
     mp_client = mercadopago.MP(MP_ACCESS_TOKEN)
 else:
     mp_client = None
-    logging.warning("MP_ACCESS_TOKEN não configurada. Pagamentos via Mercado Pago desativados.")
+    logger.warning("MP_ACCESS_TOKEN não configurada. Pagamentos via Mercado Pago desativados.")
 
 
-# MongoDB connection
-mongo_url = os.environ.get('MONGO_URL')
-client = None
-db = None
-if not mongo_url:
-    logging.warning("MONGO_URL not found. Database will not be functional.")
-else:
-    try:
-        client = AsyncIOMotorClient(mongo_url)
-        db_name = os.environ.get('DB_NAME', 'youtube_summary_db')
-        db = client[db_name]
-    except Exception as e:
-        logging.error(f"Failed to connect to MongoDB at startup: {e}")
-        client = None
-        db = None
+# MongoDB connection (o cliente é criado no lifespan da aplicação)
+MONGO_URL = os.environ.get('MONGO_URL')
+DB_NAME = os.environ.get('DB_NAME', 'youtube_summary_db')
+MONGO_CLIENT_OPTIONS = {
+    "maxPoolSize": 200,
+    "minPoolSize": 20,
+    "maxIdleTimeMS": 30000,
+    "serverSelectionTimeoutMS": 2000,
+    "compressors": "zstd,zlib",
+}
+
+# Redis (opcional): contador do rate limit e cache exato das respostas da IA.
+# from_url não abre conexão; ela é feita no primeiro comando.
+redis_client = aioredis.from_url(REDIS_URL, decode_responses=True) if REDIS_URL else None
 
 # LLM Configuration
+GEMINI_MODEL = 'gemini-2.5-flash'
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
 gemini_client = None
 try:
     if GEMINI_API_KEY:
         gemini_client = genai.Client(api_key=GEMINI_API_KEY)
     else:
-        logging.warning("GEMINI_API_KEY não configurada. A integração com IA pode falhar.")
+        logger.warning("GEMINI_API_KEY não configurada. A integração com IA pode falhar.")
 
 except Exception as e:
-    logging.error(f"Erro ao inicializar o cliente Gemini: {e}")
+    logger.error("Erro ao inicializar o cliente Gemini: %s", e)
     gemini_client = None
 
+# Vazão das chamadas ao Gemini (por processo): concorrência máxima e requisições por minuto
+GEMINI_MAX_CONCURRENCY = int(os.environ.get('GEMINI_MAX_CONCURRENCY', '4'))
+GEMINI_RPM = float(os.environ.get('GEMINI_RPM', '60'))
+
+# Limites de entrada da IA (tokens estimados em ~4 caracteres por token)
+CHARS_PER_TOKEN = 4
+AI_TOKEN_BUDGET = 60000 # Acima disso o texto é processado em partes (map-reduce)
+AI_CHUNK_TOKENS = 50000
+AI_CHUNK_OVERLAP_TOKENS = 1000
+MAX_INPUT_CHARS = 2_000_000 # Acima disso a requisição é rejeitada com 413
+
+# Configuração do Cache Semântico da IA
+CACHE_SIM_THRESHOLD = float(os.environ.get('CACHE_SIM_THRESHOLD', '0.95'))
+AI_CACHE_TTL_SECONDS = 86400
+AI_CACHE_MAX_ENTRIES = 2000 # Por tarefa, em memória
+EMBEDDING_MODEL = 'text-embedding-004'
+EMBEDDING_MAX_CHARS = 8000
+
+# Configuração da Escrita em Lote no MongoDB
+WRITE_BATCH_SIZE = 500
+WRITE_FLUSH_INTERVAL_SECONDS = 0.1
+UNACKNOWLEDGED_COLLECTIONS = {"summaries", "enrichments", "rate_limits"} # Gravadas com w=0
+WRITE_QUEUE: asyncio.Queue = asyncio.Queue()
+
+# Cache HTTP da listagem de vídeos (GET /api/videos)
+VIDEOS_LIST_MAX_AGE_SECONDS = 5
+_videos_list_cache = {"etag": None, "expires_at": 0.0, "body": b""}
+
+# Threads do executor padrão (asyncio.to_thread): transcrições e SDKs síncronos
+THREAD_POOL_MAX_WORKERS = 64
+
+# Configuração da Transcrição (YouTube)
+TRANSCRIPT_CACHE_TTL_SECONDS = 7 * 86400
+VIDEO_CACHE_MAX_AGE_SECONDS = 7 * 86400 # Vídeos mais antigos são reprocessados em vez de reaproveitados
+TRANSCRIPT_MEMORY_CACHE_SIZE = 1024
+TRANSCRIPT_MEMORY_CACHE_TTL_SECONDS = 3600
+# Lista de proxies separados por vírgula; usados em rodízio a cada chamada
+TRANSCRIPTION_PROXIES = [
+    p.strip() for p in os.environ.get('TRANSCRIPTION_PROXIES', os.environ.get('TRANSCRIPTION_PROXY', '')).split(',')
+    if p.strip()
+]
+
+
+# --- Prompts ---
+SYSTEM_MESSAGES = {
+    "summarize": "Você é um especialista em resumir conteúdo de vídeos do YouTube. Crie resumos claros, estruturados e informativos em português brasileiro.",
+    "enrich": "Você é um especialista em aprimorar e enriquecer conteúdo. Adicione insights, organize melhor as informações e forneça contexto adicional valioso em português brasileiro."
+}
+
+# Templates dos prompts; {text} é preenchido com str.format a cada requisição
+PROMPT_TEMPLATES = {
+    "summarize": """
+Analise o seguinte texto de um vídeo do YouTube e crie um resumo estruturado:
+
+**TEXTO:**
+{text}
+
+**INSTRUÇÕES:**
+- Crie um resumo em português brasileiro
+- Use tópicos organizados com bullet points
+- Destaque os pontos principais
+- Mantenha entre 200-500 palavras
+- Use formatação markdown para melhor apresentação
+
+**ESTRUTURA ESPERADA:**
+## 📝 Resumo Executivo
+## 🎯 Pontos Principais
+## 💡 Insights Importantes
+## 📋 Conclusão
+""",
+    "enrich": """
+Analise o seguinte texto e crie uma versão aprimorada e enriquecida:
+
+**TEXTO:**
+{text}
+
+**INSTRUÇÕES:**
+- Organize o conteúdo de forma mais estruturada
+- Adicione insights e contexto relevante
+- Inclua possíveis aplicações práticas
+- Use formatação markdown
+- Responda em português brasileiro
+- Expanda conceitos importantes
+
+**ESTRUTURA ESPERADA:**
+## 🚀 Conteúdo Aprimorado
+## 🔍 Análise Detalhada
+## 💼 Aplicações Práticas
+## 🎓 Conceitos Chave
+## 📈 Próximos Passos
+"""
+}
+
 
 # --- Modelos de Dados ---
+
+_LAST_TS = [0.0, None]
+
+def _now() -> datetime:
+    """Timestamp UTC reaproveitado por até 10 ms, evitando construir um datetime por modelo criado."""
+    t = time.time()
+    if t - _LAST_TS[0] > 0.01:
+        _LAST_TS[:] = [t, datetime.fromtimestamp(t, timezone.utc)]
+    return _LAST_TS[1]
+
+def _new_id() -> str:
+    """ID aleatório de 128 bits em hex (sem o objeto UUID intermediário)."""
+    return secrets.token_hex(16)
+
 class VideoRequest(BaseModel):
     url: str
 
@@ -91,184 +240,837 @@ class TranscriptRequest(BaseModel):
     text: str
 
 class VideoResponse(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    model_config = ConfigDict(extra='ignore', validate_assignment=False, arbitrary_types_allowed=True)
+
+    id: str = Field(default_factory=_new_id)
     url: str
+    video_id: Optional[str] = None
     transcript: str
     summary: Optional[str] = None
     enrichment: Optional[str] = None
-    timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    timestamp: datetime = Field(default_factory=_now)
+
+class VideoListItem(BaseModel):
+    id: str
+    url: str
+    video_id: Optional[str] = None
+    timestamp: datetime
+
+_VIDEO_LIST_ADAPTER = TypeAdapter(List[VideoListItem])
 
 class ProcessResult(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    model_config = ConfigDict(extra='ignore', validate_assignment=False, arbitrary_types_allowed=True)
+
+    id: str = Field(default_factory=_new_id)
     result: str
-    timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    timestamp: datetime = Field(default_factory=_now)
 
 
 # --- Lógica de Rate Limiting com Bypass (Monetização) ---
 
+_rate_windows: Dict[str, deque] = defaultdict(deque)
+
+def _check_rate_limit_memory(client_id: str, now: float, cost: int):
+    """Janela deslizante em memória; sem await no meio, então é atômica dentro do event loop."""
+    window = _rate_windows[client_id]
+    while window and window[0] < now - RATE_LIMIT_DURATION_SECONDS:
+        window.popleft()
+    if len(window) + cost > MAX_REQUESTS_PER_HOUR:
+        logger.warning("Rate limit exceeded for client: %s", client_id)
+        raise HTTPException(
+            status_code=429, 
+            detail=f"Limite de requisições ({MAX_REQUESTS_PER_HOUR}/hora) excedido. Faça upgrade para a Versão Pro para uso ilimitado!",
+        )
+    window.extend([now] * cost)
+
+async def _check_rate_limit_redis(client_id: str, cost: int):
+    """Janela fixa no Redis: INCRBY + TTL em um round-trip; EXPIRE só quando a chave ainda não expira.
+
+    Evita `EXPIRE ... NX`, que só existe a partir do Redis 7: no Redis 6 o MULTI inteiro falha e o
+    limite deixaria de ser aplicado. Checar o TTL (em vez de `count == 1`) também recupera uma chave
+    que ficou sem expiração se o processo caiu entre o INCR e o EXPIRE.
+    """
+    key = f"rl:{client_id}"
+    try:
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.incrby(key, cost)
+            pipe.ttl(key)
+            request_count, ttl = await pipe.execute()
+        if ttl == -1:
+            await redis_client.expire(key, RATE_LIMIT_DURATION_SECONDS)
+    except aioredis.RedisError as e:
+        # Indisponibilidade do Redis não deve derrubar o serviço
+        logger.error("Falha ao verificar o rate limit no Redis: %s", e)
+        return
+    if request_count > MAX_REQUESTS_PER_HOUR:
+        try:
+            # Requisição recusada não consome a cota: devolve o que foi cobrado
+            await redis_client.decrby(key, cost)
+        except aioredis.RedisError as e:
+            logger.error("Falha ao devolver a cota no Redis: %s", e)
+        logger.warning("Rate limit exceeded for client: %s", client_id)
+        raise HTTPException(
+            status_code=429, 
+            detail=f"Limite de requisições ({MAX_REQUESTS_PER_HOUR}/hora) excedido. Faça upgrade para a Versão Pro para uso ilimitado!",
+        )
+
+async def evict_idle_rate_windows():
+    """Remove periodicamente os clientes sem requisições na última janela."""
+    while True:
+        await asyncio.sleep(RATE_LIMIT_DURATION_SECONDS)
+        cutoff = time.time() - RATE_LIMIT_DURATION_SECONDS
+        for client_id in [c for c, w in _rate_windows.items() if not w or w[-1] < cutoff]:
+            del _rate_windows[client_id]
+
+def _record_rate_limit_usage(client_id: str, current_time: datetime, cost: int):
+    """Registro apenas para análise em `rate_limits`; não bloqueia a requisição."""
+    WRITE_QUEUE.put_nowait(('rate_limits', {
+        "client_id": client_id,
+        "timestamp": current_time,
+        "type": "ai_call",
+        "cost": cost
+    }))
+
 async def check_rate_limit(
-    collection: AgnosticCollection, 
+    collection: Optional[AgnosticCollection],
     client_id: str,
-    pro_key_header: Optional[str] = None
+    current_time: datetime,
+    cost: int = 1
 ):
-    """Verifica e atualiza o limite de requisições por IP na última hora, com bypass Pro."""
+    """Verifica e atualiza o limite de requisições por IP na última hora.
+
+    `current_time` é o instante da requisição, o mesmo usado nos documentos que ela grava. As `cost`
+    chamadas são cobradas de uma vez: ou cabem todas na janela, ou a requisição é recusada sem consumir nada.
+    """
     
-    # 1. BYPASS PRO KEY: Se a chave Pro for enviada e for válida, ignora o limite.
-    if pro_key_header and pro_key_header == PRO_API_KEY:
-        logging.info(f"PRO_API_KEY valid. Bypassing rate limit for client: {client_id}")
+    if RATE_LIMIT_BACKEND in ('memory', 'redis'):
+        if RATE_LIMIT_BACKEND == 'redis' and redis_client is not None:
+            await _check_rate_limit_redis(client_id, cost)
+        else:
+            _check_rate_limit_memory(client_id, current_time.timestamp(), cost)
+        if collection is not None:
+            _record_rate_limit_usage(client_id, current_time, cost)
         return
     
-    if db is None:
-        logging.warning("DB is None. Skipping rate limit check.")
+    if collection is None:
+        logger.warning("DB is None. Skipping rate limit check.")
         return
     
-    current_time = datetime.now(timezone.utc)
     one_hour_ago = current_time - timedelta(seconds=RATE_LIMIT_DURATION_SECONDS)
     
-    # Limpa entradas antigas (mais de uma hora)
-    await collection.delete_many({
-        "client_id": client_id,
-        "timestamp": {"$lt": one_hour_ago}
-    })
-    
-    # Conta as requisições restantes
-    request_count = await collection.count_documents({
-        "client_id": client_id
-    })
+    # Um único documento por cliente: descarta eventos antigos, decide e registra em um só round-trip
+    pipeline = [
+        {"$set": {"events": {"$filter": {
+            "input": {"$ifNull": ["$events", []]},
+            "cond": {"$gte": ["$$this", one_hour_ago]}
+        }}}},
+        {"$set": {"allowed": {"$lte": [{"$add": [{"$size": "$events"}, cost]}, MAX_REQUESTS_PER_HOUR]}}},
+        {"$set": {
+            "events": {"$cond": ["$allowed", {"$concatArrays": ["$events", [current_time] * cost]}, "$events"]},
+            "updated_at": current_time
+        }}
+    ]
+    try:
+        window = await collection.find_one_and_update(
+            {"client_id": client_id}, pipeline, upsert=True, return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # Dois upserts simultâneos para um cliente novo: o segundo encontra o documento na nova tentativa
+        window = await collection.find_one_and_update(
+            {"client_id": client_id}, pipeline, upsert=True, return_document=ReturnDocument.AFTER
+        )
     
-    if request_count >= MAX_REQUESTS_PER_HOUR:
+    if not window["allowed"]:
         # Limite excedido
-        logging.warning(f"Rate limit exceeded for client: {client_id}")
+        logger.warning("Rate limit exceeded for client: %s", client_id)
         raise HTTPException(
             status_code=429, 
             detail=f"Limite de requisições ({MAX_REQUESTS_PER_HOUR}/hora) excedido. Faça upgrade para a Versão Pro para uso ilimitado!",
         )
-    
-    # Registra a nova requisição
-    await collection.insert_one({
-        "client_id": client_id,
-        "timestamp": current_time,
-        "type": "ai_call"
-    })
+    _record_rate_limit_usage(client_id, current_time, cost)
+
+
+# --- Cache Semântico das Respostas da IA ---
+
+class SemanticCache:
+    """Reaproveita respostas da IA para textos quase idênticos (similaridade de cosseno dos embeddings).
+
+    O índice fica em memória (um buffer circular por tarefa) e é persistido na coleção `ai_cache`,
+    de onde é recarregado na inicialização. Os embeddings são gravados como float32 em `bson.Binary`.
+    """
+
+    def __init__(self, threshold: float, ttl_seconds: int, max_entries: int):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._index = {}
+
+    async def embed(self, text: str) -> Optional[np.ndarray]:
+        """Gera o embedding normalizado do texto. Retorna None se a API falhar (o cache é opcional).
+
+        O texto deve ter até EMBEDDING_MAX_CHARS caracteres: um embedding só de um prefixo faria
+        textos diferentes com o mesmo início (ex.: vinhetas de uma série) parecerem idênticos.
+        """
+        try:
+            result = await gemini_client.aio.models.embed_content(
+                model=EMBEDDING_MODEL,
+                contents=text
+            )
+            vector = np.asarray(result.embeddings[0].values, dtype=np.float32)
+        except Exception as e:
+            logger.warning("Falha ao gerar embedding para o cache semântico: %s", e)
+            return None
+
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def lookup(self, task: str, embedding: np.ndarray) -> Optional[str]:
+        """Retorna a resposta mais similar da mesma tarefa se ultrapassar o limiar."""
+        entry = self._index.get(task)
+        if entry is None or entry["vectors"].shape[1] != embedding.shape[0]:
+            return None
+
+        scores = entry["vectors"] @ embedding
+        # Posições vazias (created == 0) e entradas expiradas nunca são consideradas
+        scores[entry["created"] < time.time() - self.ttl_seconds] = -1.0
+        best = int(np.argmax(scores))
+        if scores[best] >= self.threshold:
+            return entry["responses"][best]
+        return None
+
+    def _add(self, task: str, embedding: np.ndarray, response: str, created: float):
+        entry = self._index.get(task)
+        if entry is None or entry["vectors"].shape[1] != embedding.shape[0]:
+            entry = {
+                "vectors": np.zeros((self.max_entries, embedding.shape[0]), dtype=np.float32),
+                "created": np.zeros(self.max_entries, dtype=np.float64),
+                "responses": [None] * self.max_entries,
+                "pos": 0,
+            }
+            self._index[task] = entry
+
+        pos = entry["pos"]
+        entry["vectors"][pos] = embedding
+        entry["created"][pos] = created
+        entry["responses"][pos] = response
+        entry["pos"] = (pos + 1) % self.max_entries
+
+    async def load(self, collection: AgnosticCollection):
+        """Reconstrói o índice em memória a partir das entradas ainda válidas no MongoDB."""
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.ttl_seconds)
+        for task in ("summarize", "enrich"):
+            cursor = collection.find(
+                {"task": task, "created_at": {"$gte": cutoff}, "embedding_covers_text": True},
+                {"_id": 0, "embedding": 1, "response": 1, "created_at": 1}
+            ).sort("created_at", -1).limit(self.max_entries)
+            docs = await cursor.to_list(length=self.max_entries)
+
+            for doc in reversed(docs):
+                created_at = doc["created_at"]
+                if created_at.tzinfo is None:
+                    created_at = created_at.replace(tzinfo=timezone.utc)
+                embedding = np.frombuffer(doc["embedding"], dtype=np.float32)
+                self._add(task, embedding, doc["response"], created_at.timestamp())
+
+    def store(self, key: str, task: str, embedding: Optional[np.ndarray], response: str) -> UpdateOne:
+        """Registra a resposta no índice semântico (se houver embedding) e devolve a operação de gravação.
+
+        A operação grava sob a chave exata (hash) e deve ser enviada à WRITE_QUEUE.
+        """
+        created_at = _now()
+        document = {"key": key, "task": task, "response": response, "created_at": created_at}
+        if embedding is not None:
+            self._add(task, embedding, response, created_at.timestamp())
+            document["embedding"] = Binary(embedding.astype(np.float32).tobytes())
+            # Entradas antigas tinham embeddings só do prefixo do texto e não são recarregadas
+            document["embedding_covers_text"] = True
+        # Upsert pela chave: outro worker pode ter gravado a mesma resposta entre o lookup e aqui
+        return UpdateOne({"key": key}, {"$setOnInsert": document}, upsert=True)
+
+
+semantic_cache = SemanticCache(CACHE_SIM_THRESHOLD, AI_CACHE_TTL_SECONDS, AI_CACHE_MAX_ENTRIES)
+
+
+# --- Compressão de Transcrições ---
+
+_ZSTD_COMPRESSOR = zstd.ZstdCompressor(level=6)
+_ZSTD_DECOMPRESSOR = zstd.ZstdDecompressor()
+
+def compress_transcript(document: dict) -> dict:
+    """Substitui o campo `transcript` pelo texto comprimido com zstd (marcado com `_codec`)."""
+    document["transcript"] = Binary(_ZSTD_COMPRESSOR.compress(document["transcript"].encode('utf-8')))
+    document["_codec"] = "zstd"
+    return document
+
+def decompress_transcript(document: dict) -> dict:
+    """Inverso de compress_transcript; documentos antigos (texto puro) são devolvidos como estão."""
+    if document.pop("_codec", None) == "zstd":
+        document["transcript"] = _ZSTD_DECOMPRESSOR.decompress(document["transcript"]).decode('utf-8')
+    return document
+
+
+# --- Escrita em Lote no MongoDB ---
+
+async def flush_writes(db: AgnosticDatabase, batch: list):
+    """Agrupa os itens por coleção e grava cada grupo com um único bulk_write.
+
+    Cada item é um documento (inserido com InsertOne) ou uma operação do pymongo já montada.
+    """
+    operations = {}
+    for collection_name, document in batch:
+        operation = document if isinstance(document, (InsertOne, UpdateOne)) else InsertOne(document)
+        operations.setdefault(collection_name, []).append(operation)
+
+    for collection_name, ops in operations.items():
+        collection = db[collection_name]
+        if collection_name in UNACKNOWLEDGED_COLLECTIONS:
+            collection = collection.with_options(write_concern=WriteConcern(w=0))
+        try:
+            await collection.bulk_write(ops, ordered=False)
+        except Exception as e:
+            logger.error("Falha na gravação em lote em '%s' (%s docs): %s", collection_name, len(ops), e)
+
+async def writer_loop(db: AgnosticDatabase):
+    """Consome a WRITE_QUEUE e grava até WRITE_BATCH_SIZE itens ou a cada WRITE_FLUSH_INTERVAL_SECONDS.
+
+    Um item None na fila encerra o loop após gravar o lote pendente.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        item = await WRITE_QUEUE.get()
+        if item is None:
+            return
+        batch = [item]
+        deadline = loop.time() + WRITE_FLUSH_INTERVAL_SECONDS
+        stop = False
+
+        while len(batch) < WRITE_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(WRITE_QUEUE.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if item is None:
+                stop = True
+                break
+            batch.append(item)
+
+        await flush_writes(db, batch)
+        if stop:
+            return
+
+
+# --- Controle de Vazão do Gemini ---
+
+class TokenBucket:
+    """Balde de fichas reabastecido continuamente a `rate_per_minute` fichas por minuto."""
+
+    def __init__(self, rate_per_minute: float):
+        self.rate = rate_per_minute / 60
+        self.capacity = max(1.0, rate_per_minute)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+_gemini_gate = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+_gemini_bucket = TokenBucket(GEMINI_RPM)
+
+@asynccontextmanager
+async def gemini_slot():
+    """Espera por uma vaga de concorrência e uma ficha de RPM antes de chamar o Gemini."""
+    async with _gemini_gate:
+        await _gemini_bucket.acquire()
+        yield
 
 
 # --- Funções de Negócio ---
 
+_VIDEO_ID_RE = re.compile(
+    r'(?:youtube(?:-nocookie)?\.com/(?:watch\?(?:[^#\s]*&)?v=|embed/|v/|shorts/|live/)|youtu\.be/)'
+    r'(?P<id>[A-Za-z0-9_-]{11})(?![A-Za-z0-9_-])'
+)
+# IDs codificam 64 bits em 11 caracteres base64url, então o último só pode ser um destes 16.
+# Isso impede que qualquer palavra de 11 caracteres (ex.: "invalid-url") passe como ID.
+_BARE_VIDEO_ID_RE = re.compile(r'[A-Za-z0-9_-]{10}[AEIMQUYcgkosw048]')
+
+@functools.lru_cache(maxsize=4096)
 def extract_video_id(url: str) -> str:
-    """Extrai o ID do vídeo de diversas URLs do YouTube"""
-    patterns = [
-        r'(?:youtube\.com/watch\?v=|youtu\.be/)([^&\n?#]+)',
-        r'youtube\.com/embed/([^&\n?#]+)',
-        r'youtube\.com/v/([^&\n?#]+)'
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, url)
-        if match:
-            return match.group(1)
-    
+    """Extrai o ID do vídeo de diversas URLs do YouTube (ou aceita o próprio ID de 11 caracteres)"""
+    if _BARE_VIDEO_ID_RE.fullmatch(url):
+        return url
+    match = _VIDEO_ID_RE.search(url)
+    if match:
+        return match.group('id')
+
     raise ValueError("Invalid YouTube URL")
 
-async def get_youtube_transcript(video_id: str) -> str:
-    """Get YouTube transcript with fallback languages and proxy support."""
-    
-    proxy_url = os.environ.get('TRANSCRIPTION_PROXY')
-    proxies = {'http': proxy_url, 'https': proxy_url} if proxy_url else None
+# Idiomas em ordem de preferência (resolvidos pela biblioteca em uma única listagem)
+TRANSCRIPT_LANGUAGES = ['pt', 'pt-BR', 'en', 'en-US']
 
-    try:
-        # Tenta buscar PT e EN
-        transcript_list = YouTubeTranscriptApi.get_transcript(
-            video_id, 
-            languages=['pt', 'en', 'pt-BR', 'en-US'],
-            # Argumento proxies removido para evitar erro de lib
+def _pooled_session() -> requests.Session:
+    """Sessão HTTP com pool maior que o padrão (10), para reaproveitar conexões TLS entre as threads."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=20, pool_maxsize=50)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def _build_transcript_apis() -> List[YouTubeTranscriptApi]:
+    if not TRANSCRIPTION_PROXIES:
+        return [YouTubeTranscriptApi(http_client=_pooled_session())]
+    return [
+        YouTubeTranscriptApi(
+            proxy_config=GenericProxyConfig(http_url=proxy, https_url=proxy),
+            http_client=_pooled_session()
         )
-        transcript_text = ' '.join([entry['text'] for entry in transcript_list])
+        for proxy in TRANSCRIPTION_PROXIES
+    ]
+
+_transcript_apis = itertools.cycle(_build_transcript_apis())
+
+# Transcrições recentes em memória (video_id -> texto). Acessado apenas pelo event loop, sem lock.
+_transcript_cache = TTLCache(maxsize=TRANSCRIPT_MEMORY_CACHE_SIZE, ttl=TRANSCRIPT_MEMORY_CACHE_TTL_SECONDS)
+
+@retry(
+    stop=stop_after_attempt(4),
+    wait=wait_exponential_jitter(initial=0.5, max=8),
+    retry=retry_if_exception_type((RequestBlocked, YouTubeRequestFailed)),
+    reraise=True
+)
+def _fetch_sync(video_id: str, languages: List[str]):
+    """Chamada bloqueante à API do YouTube (executada em uma thread).
+
+    Bloqueios/throttling (429) são repetidos com backoff exponencial, trocando de proxy a cada tentativa.
+    """
+    return next(_transcript_apis).fetch(video_id, languages=languages)
+
+async def get_youtube_transcript(video_id: str, db: Optional[AgnosticDatabase]) -> str:
+    """Get YouTube transcript with fallback languages and proxy support.
+
+    Ordem de busca: memória -> MongoDB (coleção transcripts) -> YouTube.
+    """
+
+    transcript_text = _transcript_cache.get(video_id)
+    if transcript_text is not None:
         return transcript_text
-        
+
+    if db is not None:
+        cached = await db.transcripts.find_one({"video_id": video_id}, {"_id": 0, "transcript": 1, "_codec": 1})
+        if cached:
+            transcript_text = decompress_transcript(cached)["transcript"]
+            _transcript_cache[video_id] = transcript_text
+            return transcript_text
+
+    try:
+        transcript = await asyncio.to_thread(_fetch_sync, video_id, TRANSCRIPT_LANGUAGES)
     except Exception as e:
-        logging.error(f"Erro na transcrição: {e}")
+        logger.error("Erro na transcrição: %s", e)
         raise HTTPException(status_code=400, detail=f"Não foi possível obter a transcrição. (ID de vídeo inválido ou erro de API): {str(e)}")
 
-async def process_with_ai(text: str, task: str) -> str:
-    """Process text with AI using Google Generative AI (Gemini) direct client"""
-    
-    if gemini_client is None:
-        raise HTTPException(status_code=500, detail="Cliente Gemini não inicializado. Verifique a GEMINI_API_KEY.")
-    
-    system_messages = {
-        "summarize": "Você é um especialista em resumir conteúdo de vídeos do YouTube. Crie resumos claros, estruturados e informativos em português brasileiro.",
-        "enrich": "Você é um especialista em aprimorar e enriquecer conteúdo. Adicione insights, organize melhor as informações e forneça contexto adicional valioso em português brasileiro."
+    transcript_text = ' '.join(map(attrgetter('text'), transcript))
+    _transcript_cache[video_id] = transcript_text
+    if db is not None:
+        WRITE_QUEUE.put_nowait(('transcripts', UpdateOne(
+            {"video_id": video_id},
+            {"$set": compress_transcript({"transcript": transcript_text, "created_at": _now()})},
+            upsert=True
+        )))
+    return transcript_text
+
+async def find_cached_video(db: Optional[AgnosticDatabase], video_id: str, now: datetime) -> Optional[VideoResponse]:
+    """Busca um vídeo processado pelo ID do YouTube nos últimos VIDEO_CACHE_MAX_AGE_SECONDS."""
+    if db is None:
+        return None
+    fresh_since = now - timedelta(seconds=VIDEO_CACHE_MAX_AGE_SECONDS)
+    video = await db.videos.find_one({"video_id": video_id, "timestamp": {"$gte": fresh_since}}, {"_id": 0})
+    if video is None:
+        return None
+    return VideoResponse.model_construct(**decompress_transcript(video))
+
+async def find_stored_video_id(db: Optional[AgnosticDatabase], video_id: str) -> Optional[str]:
+    """ID interno já gravado para o vídeo, mesmo fora da janela de reaproveitamento."""
+    if db is None:
+        return None
+    video = await db.videos.find_one({"video_id": video_id}, {"_id": 0, "id": 1})
+    return video.get("id") if video else None
+
+def video_upsert(video: VideoResponse, unset_fields: Tuple[str, ...] = ()) -> UpdateOne:
+    """Upsert do documento do vídeo que preserva o `id` interno já entregue aos clientes."""
+    update = {
+        "$set": compress_transcript(video.model_dump(mode='python', exclude_none=True, exclude={'id'})),
+        "$setOnInsert": {"id": video.id}
     }
-    
-    prompts = {
-        "summarize": f"""
-Analise o seguinte texto de um vídeo do YouTube e crie um resumo estruturado:
+    if unset_fields:
+        update["$unset"] = dict.fromkeys(unset_fields, "")
+    return UpdateOne({"video_id": video.video_id}, update, upsert=True)
 
-**TEXTO:**
-{text}
+# Configs imutáveis por tarefa, montadas uma vez em vez de a cada chamada
+_SYSTEM_INSTRUCTION_CONFIGS = {
+    task: types.GenerateContentConfig(system_instruction=message)
+    for task, message in SYSTEM_MESSAGES.items()
+}
 
-**INSTRUÇÕES:**
-- Crie um resumo em português brasileiro
-- Use tópicos organizados com bullet points
-- Destaque os pontos principais
-- Mantenha entre 200-500 palavras
-- Use formatação markdown para melhor apresentação
+def build_generation_request(text: str, task: str):
+    """Monta contents/config do Gemini para a tarefa."""
+    return [PROMPT_TEMPLATES[task].format(text=text)], _SYSTEM_INSTRUCTION_CONFIGS[task]
 
-**ESTRUTURA ESPERADA:**
-## 📝 Resumo Executivo
-## 🎯 Pontos Principais
-## 💡 Insights Importantes
-## 📋 Conclusão
-""",
-        "enrich": f"""
-Analise o seguinte texto e crie uma versão aprimorada e enriquecida:
+# Chamadas à IA em andamento, por hash de (tarefa, texto): requisições idênticas simultâneas
+# aguardam o mesmo resultado em vez de chamar o Gemini de novo.
+_INFLIGHT: Dict[str, asyncio.Task] = {}
 
-**TEXTO:**
-{text}
+def _finish_inflight(key: str, task: asyncio.Task):
+    _INFLIGHT.pop(key, None)
+    # Evita o aviso "exception was never retrieved" quando ninguém mais aguardava o resultado
+    if not task.cancelled():
+        task.exception()
 
-**INSTRUÇÕES:**
-- Organize o conteúdo de forma mais estruturada
-- Adicione insights e contexto relevante
-- Inclua possíveis aplicações práticas
-- Use formatação markdown
-- Responda em português brasileiro
-- Expanda conceitos importantes
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN
 
-**ESTRUTURA ESPERADA:**
-## 🚀 Conteúdo Aprimorado
-## 🔍 Análise Detalhada
-## 💼 Aplicações Práticas
-## 🎓 Conceitos Chave
-## 📈 Próximos Passos
-"""
-    }
+def split_text(text: str, chunk_chars: int, overlap_chars: int) -> List[str]:
+    """Divide o texto em janelas de até chunk_chars caracteres com sobreposição de overlap_chars.
+
+    Cada janela termina no último fim de frase ('. ') da sua metade final, quando houver. Como o corte pode
+    cair na metade da janela, a sobreposição precisa ser menor que isso para que o início sempre avance.
+    """
+    if overlap_chars * 2 >= chunk_chars:
+        raise ValueError("overlap_chars deve ser menor que metade de chunk_chars")
+    chunks = []
+    start = 0
+    while True:
+        end = start + chunk_chars
+        if end >= len(text):
+            chunks.append(text[start:])
+            return chunks
+        cut = text.rfind('. ', start + chunk_chars // 2, end)
+        if cut != -1:
+            end = cut + 1
+        chunks.append(text[start:end])
+        start = end - overlap_chars
+
+async def _summarize_parts(text: str, db: Optional[AgnosticDatabase]) -> str:
+    """Etapa "map": resume cada parte do texto em paralelo e junta os resumos parciais."""
+    chunks = split_text(
+        text,
+        AI_CHUNK_TOKENS * CHARS_PER_TOKEN,
+        AI_CHUNK_OVERLAP_TOKENS * CHARS_PER_TOKEN
+    )
+    partials = await asyncio.gather(*(process_with_ai(chunk, "summarize", db) for chunk in chunks))
+    return "\n\n".join(f"### Parte {i}\n{partial}" for i, partial in enumerate(partials, 1))
+
+async def _map_reduce_with_ai(text: str, task: str, db: Optional[AgnosticDatabase]) -> str:
+    """Resume cada parte do texto em paralelo e aplica a tarefa sobre os resumos parciais."""
+    return await process_with_ai(await _summarize_parts(text, db), task, db)
+
+async def process_with_ai(text: str, task: str, db: Optional[AgnosticDatabase]) -> str:
+    """Process text with AI, sharing one Gemini call among concurrent identical requests"""
+    result, _ = await process_with_ai_status(text, task, db)
+    return result
+
+async def process_with_ai_status(text: str, task: str, db: Optional[AgnosticDatabase]) -> Tuple[str, bool]:
+    """Como process_with_ai, mas também indica se a resposta veio de um cache."""
+    # Espaços nas pontas não mudam a resposta; normalizar evita misses no cache por causa deles
+    text = text.strip()
+    if estimate_tokens(text) > AI_TOKEN_BUDGET:
+        return await _map_reduce_with_ai(text, task, db), False
+
+    key = ai_cache_key(text, task)
+    inflight = _INFLIGHT.get(key)
+    if inflight is None:
+        # A chamada roda em uma tarefa própria: se o cliente que a iniciou desconectar,
+        # os demais que aguardam o mesmo resultado não são cancelados junto
+        inflight = asyncio.create_task(_generate_with_ai(text, task, key, db))
+        inflight.add_done_callback(functools.partial(_finish_inflight, key))
+        _INFLIGHT[key] = inflight
+    return await asyncio.shield(inflight)
+
+SAFETY_BLOCKED_MESSAGE = "O conteúdo da transcrição foi bloqueado pelas políticas de segurança do modelo Gemini."
+
+def ai_cache_key(text: str, task: str) -> str:
+    return hashlib.sha256(f"{task}|{text}".encode()).hexdigest()
+
+async def lookup_ai_result(key: str, task: str, db: Optional[AgnosticDatabase]) -> Optional[str]:
+    """Busca a resposta pela chave exata, primeiro no Redis e depois no MongoDB."""
+    if redis_client is not None:
+        try:
+            hit = await redis_client.get(f"ai:{key}")
+        except aioredis.RedisError as e:
+            logger.warning("Falha ao consultar o cache da IA no Redis: %s", e)
+            hit = None
+        if hit:
+            logger.info("Cache exato HIT (Redis) para a tarefa '%s'.", task)
+            return hit
+    if db is not None:
+        hit = await db.ai_cache.find_one({"key": key}, {"_id": 0, "response": 1})
+        if hit and hit.get("response"):
+            logger.info("Cache exato HIT para a tarefa '%s'.", task)
+            return hit["response"]
+    return None
+
+# Tarefas em segundo plano sem ninguém aguardando: a referência evita que sejam coletadas antes de terminar
+_BACKGROUND_TASKS: set = set()
+
+def _finish_background_task(task: asyncio.Task):
+    _BACKGROUND_TASKS.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning("Falha em tarefa de segundo plano: %s", task.exception())
+
+def fire_and_forget(coro):
+    """Agenda a corrotina sem bloquear a resposta; falhas são apenas registradas no log."""
+    task = asyncio.create_task(coro)
+    _BACKGROUND_TASKS.add(task)
+    task.add_done_callback(_finish_background_task)
+
+def store_ai_result(
+    key: str,
+    task: str,
+    embedding: Optional[np.ndarray],
+    result: str,
+    db: Optional[AgnosticDatabase]
+):
+    if redis_client is not None:
+        fire_and_forget(redis_client.setex(f"ai:{key}", AI_CACHE_TTL_SECONDS, result))
+    if db is not None:
+        WRITE_QUEUE.put_nowait(('ai_cache', semantic_cache.store(key, task, embedding, result)))
+
+async def _generate_with_ai(text: str, task: str, key: str, db: Optional[AgnosticDatabase]) -> Tuple[str, bool]:
+    """Process text with AI using Google Generative AI (Gemini) direct client"""
     
+    if gemini_client is None:
+        raise HTTPException(status_code=500, detail="Cliente Gemini não inicializado. Verifique a GEMINI_API_KEY.")
+    
+    # Cache exato: mesmo texto e mesma tarefa dispensam até o cálculo do embedding
+    hit = await lookup_ai_result(key, task, db)
+    if hit is not None:
+        return hit, True
+
+    # Cache semântico: evita uma nova chamada ao Gemini para textos já processados
+    # Textos longos demais para um único embedding ficam só no cache exato
+    embedding = None
+    if db is not None and len(text) <= EMBEDDING_MAX_CHARS:
+        embedding = await semantic_cache.embed(text)
+    if embedding is not None:
+        cached_response = semantic_cache.lookup(task, embedding)
+        if cached_response is not None:
+            logger.info("Cache semântico HIT para a tarefa '%s'.", task)
+            return cached_response, True
+
     try:
-        response = gemini_client.models.generate_content(
-            model='gemini-2.5-flash',
-            contents=[
-                prompts[task]
-            ],
-            config=types.GenerateContentConfig(
-                system_instruction=system_messages[task]
+        contents, config = build_generation_request(text, task)
+        async with gemini_slot():
+            response = await gemini_client.aio.models.generate_content(
+                model=GEMINI_MODEL,
+                contents=contents,
+                config=config
             )
-        )
         
         if response.candidates and response.candidates[0].finish_reason.name == 'SAFETY':
-             return "O conteúdo da transcrição foi bloqueado pelas políticas de segurança do modelo Gemini."
-             
-        return response.text
+             return SAFETY_BLOCKED_MESSAGE, False
+
+        store_ai_result(key, task, embedding, response.text, db)
+        return response.text, False
         
     except genai_errors.APIError as e:
-        logging.error(f"Erro de API com Gemini: {e}")
+        logger.error("Erro de API com Gemini: %s", e)
         raise HTTPException(status_code=500, detail="Erro de API com Gemini. Verifique se a GEMINI_API_KEY é válida ou se a cota foi excedida (grátis).")
     except Exception as e:
-        logging.error(f"Erro ao processar com Gemini: {e}")
+        logger.error("Erro ao processar com Gemini: %s", e)
         raise HTTPException(status_code=500, detail=f"Erro ao processar com Gemini: {str(e)}")
 
+async def stream_with_ai(
+    text: str,
+    task: str,
+    collection_name: str,
+    db: Optional[AgnosticDatabase],
+    now: datetime
+):
+    """Gera eventos SSE com os trechos da resposta do Gemini à medida que chegam.
+
+    Uma resposta já em cache é enviada de uma vez, sem chamar o Gemini. Ao final, o resultado
+    completo é gravado no cache da IA e na fila de gravação, e um evento `done` traz o id.
+    """
+    text = text.strip()
+    key = ai_cache_key(text, task)
+    parts = []
+    try:
+        cached = await lookup_ai_result(key, task, db)
+        if cached is not None:
+            parts.append(cached)
+            yield b"data: " + orjson.dumps({'delta': cached}) + b"\n\n"
+        else:
+            # Acima do orçamento, as partes são resumidas sem streaming e só a etapa final é transmitida
+            prompt_text = text
+            while estimate_tokens(prompt_text) > AI_TOKEN_BUDGET:
+                prompt_text = await _summarize_parts(prompt_text, db)
+            async for delta in process_with_ai_stream(prompt_text, task):
+                parts.append(delta)
+                yield b"data: " + orjson.dumps({'delta': delta}) + b"\n\n"
+            if not parts:
+                # Sem texto algum (ex.: bloqueio de segurança): nada a cachear nem a gravar
+                yield b"event: error\ndata: " + orjson.dumps({'detail': SAFETY_BLOCKED_MESSAGE}) + b"\n\n"
+                return
+            store_ai_result(key, task, None, ''.join(parts), db)
+    except Exception as e:
+        logger.error("Erro no streaming com Gemini: %s", e)
+        yield b"event: error\ndata: " + orjson.dumps({'detail': 'Erro ao processar com Gemini.'}) + b"\n\n"
+        return
+
+    result = ProcessResult(result=''.join(parts), timestamp=now)
+    if db is not None:
+        WRITE_QUEUE.put_nowait((collection_name, result.model_dump(mode='python', exclude_none=True)))
+    yield b"event: done\ndata: " + orjson.dumps({'id': result.id}) + b"\n\n"
+
+async def process_with_ai_stream(text: str, task: str):
+    """Produz os trechos de texto da resposta do Gemini à medida que chegam."""
+    contents, config = build_generation_request(text, task)
+    async with gemini_slot():
+        stream = await gemini_client.aio.models.generate_content_stream(
+            model=GEMINI_MODEL,
+            contents=contents,
+            config=config
+        )
+        async for chunk in stream:
+            if chunk.text:
+                yield chunk.text
+
+def sse_response(events) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 
 # --- Configuração do FastAPI ---
-app = FastAPI()
+
+async def create_indexes(db: AgnosticDatabase):
+    try:
+        await db.videos.create_index([('timestamp', -1)])
+        await db.videos.create_index('id')
+        await db.videos.create_index('video_id', unique=True, sparse=True)
+        await db.ai_cache.create_index("created_at", expireAfterSeconds=AI_CACHE_TTL_SECONDS)
+        await db.ai_cache.create_index("key", unique=True, sparse=True)
+        await db.transcripts.create_index("video_id", unique=True)
+        await db.transcripts.create_index("created_at", expireAfterSeconds=TRANSCRIPT_CACHE_TTL_SECONDS)
+        await db.rate_limit_windows.create_index("client_id", unique=True)
+        await db.rate_limit_windows.create_index("updated_at", expireAfterSeconds=RATE_LIMIT_DURATION_SECONDS)
+        await ensure_rate_limits_indexes(db)
+    except Exception as e:
+        logger.error("Falha ao criar os índices do MongoDB: %s", e)
+
+async def ensure_rate_limits_indexes(db: AgnosticDatabase):
+    """Índices de `rate_limits`, que guarda só registros de análise (nada mais lê a coleção)."""
+    try:
+        # Índice composto de quando a coleção ainda era consultada pelo rate limit
+        await db.rate_limits.drop_index([("client_id", 1), ("timestamp", 1)])
+    except OperationFailure:
+        pass
+    try:
+        await db.rate_limits.create_index("timestamp", expireAfterSeconds=RATE_LIMIT_ANALYTICS_TTL_SECONDS)
+    except OperationFailure:
+        # O TTL antigo (1h) já existe com outro expireAfterSeconds; ajusta no lugar
+        await db.command(
+            "collMod", "rate_limits",
+            index={"keyPattern": {"timestamp": 1}, "expireAfterSeconds": RATE_LIMIT_ANALYTICS_TTL_SECONDS}
+        )
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Cria as conexões e tarefas de fundo na inicialização e as encerra no desligamento."""
+    # O padrão (min(32, CPUs + 4)) limita quantas transcrições podem estar em andamento ao mesmo tempo
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=THREAD_POOL_MAX_WORKERS))
+    mongo_client = None
+    app.state.db = None
+    if not MONGO_URL:
+        logger.warning("MONGO_URL not found. Database will not be functional.")
+    else:
+        try:
+            mongo_client = AsyncIOMotorClient(MONGO_URL, **MONGO_CLIENT_OPTIONS)
+            app.state.db = mongo_client[DB_NAME]
+        except Exception as e:
+            logger.error("Failed to connect to MongoDB at startup: %s", e)
+            mongo_client = None
+
+    db = app.state.db
+    writer_task = None
+    if db is not None:
+        await create_indexes(db)
+        try:
+            await semantic_cache.load(db.ai_cache)
+        except Exception as e:
+            logger.error("Falha ao carregar o cache semântico da IA: %s", e)
+        writer_task = asyncio.create_task(writer_loop(db))
+
+    rate_window_eviction_task = None
+    if RATE_LIMIT_BACKEND == 'memory':
+        rate_window_eviction_task = asyncio.create_task(evict_idle_rate_windows())
+
+    yield
+
+    if rate_window_eviction_task:
+        rate_window_eviction_task.cancel()
+    if writer_task:
+        # Grava o que ainda estiver na fila antes de fechar a conexão
+        WRITE_QUEUE.put_nowait(None)
+        await writer_task
+    if mongo_client:
+        mongo_client.close()
+    if redis_client is not None:
+        await redis_client.aclose()
+
+def _client_ip(request: Request) -> str:
+    """IP do cliente segundo os proxies confiáveis, ou o peer da conexão.
+
+    Os valores à esquerda do X-Forwarded-For são escritos pelo próprio cliente; só a entrada
+    acrescentada pelo proxy mais externo (a TRUSTED_PROXY_HOPS-ésima da direita) é confiável.
+    """
+    if TRUSTED_PROXY_HOPS > 0:
+        forwarded_for = [ip.strip() for ip in request.headers.get("x-forwarded-for", "").split(",") if ip.strip()]
+        if len(forwarded_for) >= TRUSTED_PROXY_HOPS:
+            return forwarded_for[-TRUSTED_PROXY_HOPS]
+    return request.client.host if request.client else ""
+
+def request_time() -> datetime:
+    """Instante da requisição. O FastAPI guarda o resultado por requisição, então o rate limit e a
+    rota recebem o mesmo valor."""
+    return datetime.now(timezone.utc)
+
+RequestTime = Annotated[datetime, Depends(request_time)]
+
+def rate_limited(cost: int = 1):
+    """Dependência de rate limit; `cost` é o número de chamadas de IA que a rota consome."""
+    async def dependency(
+        request: Request,
+        now: RequestTime,
+        x_pro_key: Annotated[Optional[str], Header(alias="X-PRO-KEY")] = None
+    ):
+        # BYPASS PRO KEY: Se a chave Pro for enviada e for válida, ignora o limite sem tocar no banco.
+        if x_pro_key and x_pro_key == PRO_API_KEY:
+            logger.info("PRO_API_KEY valid. Bypassing rate limit.")
+            return
+        client_ip = _client_ip(request)
+        if not client_ip:
+            return
+        db = get_db(request)
+        collection = db.rate_limit_windows if db is not None else None
+        await check_rate_limit(collection, client_ip, now, cost)
+    return dependency
+
+def get_db(request: Request) -> Optional[AgnosticDatabase]:
+    return request.app.state.db
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 api_router = APIRouter(prefix="/api")
 
 
@@ -310,63 +1112,133 @@ async def create_preference():
     }
 
     try:
-        preference = mp_client.create_preference(preference_data)
+        # O SDK do Mercado Pago é síncrono; roda fora do event loop
+        preference = await asyncio.to_thread(mp_client.create_preference, preference_data)
         # O preference['response']['init_point'] é o link de checkout
         return {"url": preference['response']['init_point']}
     except Exception as e:
-        logging.error(f"Erro ao criar preferência de checkout no Mercado Pago: {e}")
+        logger.error("Erro ao criar preferência de checkout no Mercado Pago: %s", e)
         raise HTTPException(status_code=500, detail="Erro interno ao iniciar o pagamento via Mercado Pago.")
 
 
 @api_router.post("/videos/transcribe", response_model=VideoResponse)
-async def transcribe_video(request: VideoRequest):
+async def transcribe_video(
+    request: VideoRequest,
+    db: Annotated[Optional[AgnosticDatabase], Depends(get_db)],
+    now: RequestTime
+):
     """Transcribe YouTube video"""
     try:
         video_id = extract_video_id(request.url)
-        transcript = await get_youtube_transcript(video_id)
+
+        # Vídeo já transcrito: devolve o documento salvo sem ir ao YouTube
+        cached = await find_cached_video(db, video_id, now)
+        if cached is not None:
+            return cached
+
+        transcript, stored_id = await asyncio.gather(
+            get_youtube_transcript(video_id, db),
+            find_stored_video_id(db, video_id)
+        )
         
         video_response = VideoResponse(
             url=request.url,
-            transcript=transcript
+            video_id=video_id,
+            transcript=transcript,
+            timestamp=now
         )
+        if stored_id is not None:
+            video_response.id = stored_id
         
         # Save to database
         if db is not None:
-            await db.videos.insert_one(video_response.dict())
+            # Um documento antigo (fora da janela de reaproveitamento) do mesmo vídeo é substituído, mantendo
+            # o id; resumo e aprimoramento antigos são descartados para não voltarem como se fossem novos
+            WRITE_QUEUE.put_nowait(('videos', video_upsert(video_response, unset_fields=("summary", "enrichment"))))
         else:
-            logging.warning("Database client is not available. Skipping save operation.")
+            logger.warning("Database client is not available. Skipping save operation.")
             
         return video_response
         
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        logging.error(f"Erro interno no /transcribe: {e}")
+        logger.error("Erro interno no /transcribe: %s", e)
         raise HTTPException(status_code=500, detail=f"Erro interno: {str(e)}")
 
-@api_router.post("/videos/summarize", response_model=ProcessResult)
+@api_router.post("/videos/process", response_model=VideoResponse, dependencies=[Depends(rate_limited(cost=2))])
+async def process_video(
+    request: VideoRequest,
+    db: Annotated[Optional[AgnosticDatabase], Depends(get_db)],
+    now: RequestTime
+):
+    """Transcribe, summarize and enrich a YouTube video in a single call"""
+
+    try:
+        video_id = extract_video_id(request.url)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    cached = await find_cached_video(db, video_id, now)
+    if cached is not None and cached.summary and cached.enrichment:
+        return cached
+
+    if cached is not None:
+        transcript, stored_id = cached.transcript, cached.id
+    else:
+        transcript, stored_id = await asyncio.gather(
+            get_youtube_transcript(video_id, db),
+            find_stored_video_id(db, video_id)
+        )
+    if not transcript.strip():
+        raise HTTPException(status_code=400, detail="A transcrição do vídeo está vazia.")
+
+    # Resumo e aprimoramento rodam em paralelo sobre a mesma transcrição
+    try:
+        async with asyncio.TaskGroup() as tg:
+            summary_task = tg.create_task(process_with_ai(transcript, "summarize", db))
+            enrichment_task = tg.create_task(process_with_ai(transcript, "enrich", db))
+    except ExceptionGroup as eg:
+        raise eg.exceptions[0]
+
+    video_response = VideoResponse(
+        url=request.url,
+        video_id=video_id,
+        transcript=transcript,
+        summary=summary_task.result(),
+        enrichment=enrichment_task.result(),
+        timestamp=now
+    )
+    if stored_id is not None:
+        # Completa o documento já existente em vez de criar outro para o mesmo vídeo.
+        # O timestamp novo é mantido para que o ETag da listagem mude junto com o resumo.
+        video_response.id = stored_id
+    if db is not None:
+        WRITE_QUEUE.put_nowait(('videos', video_upsert(video_response)))
+
+    return video_response
+
+@api_router.post("/videos/summarize", response_model=ProcessResult, dependencies=[Depends(rate_limited())])
 async def summarize_text(
     request: TranscriptRequest, 
-    request_info: Request,
-    x_pro_key: Annotated[Optional[str], Header(alias="X-PRO-KEY")] = None
+    response: Response,
+    db: Annotated[Optional[AgnosticDatabase], Depends(get_db)],
+    now: RequestTime
 ): 
     """Summarize transcript text"""
-    
-    # --- Lógica de Rate Limiting ---
-    client_ip, _ = get_client_ip(request_info.headers)
-    if client_ip:
-        await check_rate_limit(db.rate_limits, client_ip, x_pro_key)
-    # --- Fim Rate Limiting ---
 
     try:
         if not request.text.strip():
             raise HTTPException(status_code=400, detail="Texto não pode estar vazio")
+        if len(request.text) > MAX_INPUT_CHARS:
+            raise HTTPException(status_code=413, detail=f"Texto excede o limite de {MAX_INPUT_CHARS} caracteres.")
             
-        summary = await process_with_ai(request.text, "summarize")
+        summary, cache_hit = await process_with_ai_status(request.text, "summarize", db)
+        response.headers["X-Cache"] = "HIT" if cache_hit else "MISS"
         
-        result = ProcessResult(result=summary)
+        result = ProcessResult(result=summary, timestamp=now)
         if db is not None:
-            await db.summaries.insert_one(result.dict())
+            WRITE_QUEUE.put_nowait(('summaries', result.model_dump(mode='python', exclude_none=True)))
         
         return result
         
@@ -375,29 +1247,27 @@ async def summarize_text(
             raise e
         raise HTTPException(status_code=500, detail=f"Erro ao processar resumo: {str(e)}")
 
-@api_router.post("/videos/enrich", response_model=ProcessResult)
+@api_router.post("/videos/enrich", response_model=ProcessResult, dependencies=[Depends(rate_limited())])
 async def enrich_text(
     request: TranscriptRequest, 
-    request_info: Request,
-    x_pro_key: Annotated[Optional[str], Header(alias="X-PRO-KEY")] = None
+    response: Response,
+    db: Annotated[Optional[AgnosticDatabase], Depends(get_db)],
+    now: RequestTime
 ): 
     """Enrich and enhance transcript text"""
-    
-    # --- Lógica de Rate Limiting ---
-    client_ip, _ = get_client_ip(request_info.headers)
-    if client_ip:
-        await check_rate_limit(db.rate_limits, client_ip, x_pro_key)
-    # --- Fim Rate Limiting ---
 
     try:
         if not request.text.strip():
             raise HTTPException(status_code=400, detail="Texto não pode estar vazio")
+        if len(request.text) > MAX_INPUT_CHARS:
+            raise HTTPException(status_code=413, detail=f"Texto excede o limite de {MAX_INPUT_CHARS} caracteres.")
             
-        enrichment = await process_with_ai(request.text, "enrich")
+        enrichment, cache_hit = await process_with_ai_status(request.text, "enrich", db)
+        response.headers["X-Cache"] = "HIT" if cache_hit else "MISS"
         
-        result = ProcessResult(result=enrichment)
+        result = ProcessResult(result=enrichment, timestamp=now)
         if db is not None:
-            await db.enrichments.insert_one(result.dict())
+            WRITE_QUEUE.put_nowait(('enrichments', result.model_dump(mode='python', exclude_none=True)))
         
         return result
         
@@ -406,14 +1276,80 @@ async def enrich_text(
             raise e
         raise HTTPException(status_code=500, detail=f"Erro ao processar aprimoramento: {str(e)}")
 
-@api_router.get("/videos", response_model=List[VideoResponse])
-async def get_videos():
-    """Get all processed videos"""
+@api_router.post("/videos/summarize/stream", dependencies=[Depends(rate_limited())])
+async def summarize_text_stream(
+    request: TranscriptRequest, 
+    db: Annotated[Optional[AgnosticDatabase], Depends(get_db)],
+    now: RequestTime
+): 
+    """Summarize transcript text, streaming the result as Server-Sent Events"""
+
+    if not request.text.strip():
+        raise HTTPException(status_code=400, detail="Texto não pode estar vazio")
+    if len(request.text) > MAX_INPUT_CHARS:
+        raise HTTPException(status_code=413, detail=f"Texto excede o limite de {MAX_INPUT_CHARS} caracteres.")
+    if gemini_client is None:
+        raise HTTPException(status_code=500, detail="Cliente Gemini não inicializado. Verifique a GEMINI_API_KEY.")
+
+    return sse_response(stream_with_ai(request.text, "summarize", "summaries", db, now))
+
+@api_router.post("/videos/enrich/stream", dependencies=[Depends(rate_limited())])
+async def enrich_text_stream(
+    request: TranscriptRequest, 
+    db: Annotated[Optional[AgnosticDatabase], Depends(get_db)],
+    now: RequestTime
+): 
+    """Enrich transcript text, streaming the result as Server-Sent Events"""
+
+    if not request.text.strip():
+        raise HTTPException(status_code=400, detail="Texto não pode estar vazio")
+    if len(request.text) > MAX_INPUT_CHARS:
+        raise HTTPException(status_code=413, detail=f"Texto excede o limite de {MAX_INPUT_CHARS} caracteres.")
+    if gemini_client is None:
+        raise HTTPException(status_code=500, detail="Cliente Gemini não inicializado. Verifique a GEMINI_API_KEY.")
+
+    return sse_response(stream_with_ai(request.text, "enrich", "enrichments", db, now))
+
+@api_router.get("/videos", response_model=List[VideoListItem])
+async def get_videos(request: Request, db: Annotated[Optional[AgnosticDatabase], Depends(get_db)]):
+    """Get the most recent processed videos (metadata only; full documents via /videos/{id})"""
     if db is None:
         raise HTTPException(status_code=500, detail="Conexão com o banco de dados indisponível.")
     
-    videos = await db.videos.find().to_list(100)
-    return [VideoResponse(**video) for video in videos]
+    # ETag derivado do vídeo mais recente e do total de documentos (inserções e expirações)
+    latest = await db.videos.find_one({}, sort=[('timestamp', -1)], projection={'timestamp': 1, '_id': 0})
+    total = await db.videos.estimated_document_count()
+    version = f"{latest['timestamp'] if latest else ''}:{total}"
+    etag = f'"{hashlib.blake2s(version.encode()).hexdigest()}"'
+    headers = {'ETag': etag, 'Cache-Control': f'private, max-age={VIDEOS_LIST_MAX_AGE_SECONDS}'}
+
+    if request.headers.get('if-none-match') == etag:
+        return Response(status_code=304, headers=headers)
+
+    if _videos_list_cache["etag"] == etag and _videos_list_cache["expires_at"] > time.monotonic():
+        return Response(content=_videos_list_cache["body"], media_type="application/json", headers=headers)
+
+    cursor = db.videos.find(
+        {},
+        projection={'id': 1, 'url': 1, 'video_id': 1, 'timestamp': 1, '_id': 0}
+    ).sort('timestamp', -1).limit(100)
+    # Documentos já validados na inserção: dispensa a revalidação do Pydantic
+    videos = [VideoListItem.model_construct(**video) for video in await cursor.to_list(length=100)]
+    body = _VIDEO_LIST_ADAPTER.dump_json(videos)
+
+    _videos_list_cache.update(etag=etag, expires_at=time.monotonic() + VIDEOS_LIST_MAX_AGE_SECONDS, body=body)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@api_router.get("/videos/{id}", response_model=VideoResponse)
+async def get_video(id: str, db: Annotated[Optional[AgnosticDatabase], Depends(get_db)]):
+    """Get a single processed video by its internal `id` (not the YouTube `video_id`), including the full transcript"""
+    if db is None:
+        raise HTTPException(status_code=500, detail="Conexão com o banco de dados indisponível.")
+
+    video = await db.videos.find_one({'id': id}, {'_id': 0})
+    if video is None:
+        raise HTTPException(status_code=404, detail="Vídeo não encontrado.")
+    return VideoResponse.model_construct(**decompress_transcript(video))
 
 # Inclui o router no main app
 app.include_router(api_router)
@@ -421,19 +1357,7 @@ app.include_router(api_router)
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
-    allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
+    allow_origins=CORS_ORIGINS,
     allow_methods=["*"],
     allow_headers=["*"],
 )
-
-# Configura o logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    if client:
-        client.close()
\ No newline at end of file
@@ -1,8 +1,13 @@
 import requests
+from requests.adapters import HTTPAdapter
 import sys
-import json
+import orjson
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+MAX_PARALLEL_TESTS = 4
+
 class YouTubeAIProcessorTester:
     def __init__(self, base_url="https://ytsummary-1.preview.emergentagent.com"):
         self.base_url = base_url
@@ -10,66 +15,94 @@ class YouTubeAIProcessorTester:
         self.tests_run = 0
         self.tests_passed = 0
         self.test_results = []
+        self._lock = threading.Lock() # Testes independentes rodam em threads
+        self._local = threading.local()
+        self._sessions = [] # Sessões de todas as threads, fechadas em close_sessions()
 
-    def log_test(self, name, success, details=""):
-        """Log test result"""
-        self.tests_run += 1
-        if success:
-            self.tests_passed += 1
-            print(f"✅ {name} - PASSED")
-        else:
-            print(f"❌ {name} - FAILED: {details}")
-        
-        self.test_results.append({
-            "test": name,
-            "success": success,
-            "details": details,
-            "timestamp": datetime.now().isoformat()
-        })
+    @property
+    def session(self):
+        """Sessão por thread (requests.Session não é thread-safe); cada uma reaproveita sua conexão TLS"""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.headers.update({'Content-Type': 'application/json'})
+            session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+            self._local.session = session
+            with self._lock:
+                self._sessions.append(session)
+        return session
+
+    def close_sessions(self):
+        """Fecha as sessões criadas pelas threads dos testes"""
+        with self._lock:
+            sessions, self._sessions = self._sessions, []
+        for session in sessions:
+            session.close()
+
+    def _print(self, *lines):
+        """Imprime as linhas de uma vez, sem intercalar com a saída de outros testes"""
+        with self._lock:
+            print("\n".join(lines))
+
+    def log_test(self, name, success, details="", output=()):
+        """Log test result (com as linhas de saída do teste, impressas no mesmo bloco)"""
+        with self._lock:
+            self.tests_run += 1
+            if success:
+                self.tests_passed += 1
+                result = f"✅ {name} - PASSED"
+            else:
+                result = f"❌ {name} - FAILED: {details}"
+            print("\n".join([*output, result]))
+            
+            self.test_results.append({
+                "test": name,
+                "success": success,
+                "details": details,
+                "timestamp": datetime.now().isoformat()
+            })
 
     def run_test(self, name, method, endpoint, expected_status, data=None, timeout=30):
         """Run a single API test"""
         url = f"{self.api_url}/{endpoint}"
-        headers = {'Content-Type': 'application/json'}
 
-        print(f"\n🔍 Testing {name}...")
-        print(f"   URL: {url}")
+        lines = [f"\n🔍 Testing {name}...", f"   URL: {url}"]
         
         try:
             if method == 'GET':
-                response = requests.get(url, headers=headers, timeout=timeout)
+                response = self.session.get(url, timeout=timeout)
             elif method == 'POST':
-                response = requests.post(url, json=data, headers=headers, timeout=timeout)
+                response = self.session.post(url, json=data, timeout=timeout)
 
             success = response.status_code == expected_status
             
             if success:
-                print(f"   Status: {response.status_code} ✅")
+                lines.append(f"   Status: {response.status_code} ✅")
                 try:
                     response_data = response.json()
-                    print(f"   Response keys: {list(response_data.keys()) if isinstance(response_data, dict) else 'Non-dict response'}")
+                    lines.append(f"   Response keys: {list(response_data.keys()) if isinstance(response_data, dict) else 'Non-dict response'}")
                 except:
-                    print("   Response: Non-JSON response")
+                    lines.append("   Response: Non-JSON response")
             else:
-                print(f"   Status: {response.status_code} ❌ (Expected {expected_status})")
+                lines.append(f"   Status: {response.status_code} ❌ (Expected {expected_status})")
                 try:
                     error_detail = response.json()
-                    print(f"   Error: {error_detail}")
+                    lines.append(f"   Error: {error_detail}")
                 except:
-                    print(f"   Error: {response.text}")
+                    lines.append(f"   Error: {response.text}")
 
-            self.log_test(name, success, f"Status: {response.status_code}, Expected: {expected_status}")
+            self.log_test(name, success, f"Status: {response.status_code}, Expected: {expected_status}", lines)
             return success, response.json() if success else {}
 
         except requests.exceptions.Timeout:
             error_msg = f"Request timeout after {timeout}s"
-            print(f"   ⏰ {error_msg}")
-            self.log_test(name, False, error_msg)
+            lines.append(f"   ⏰ {error_msg}")
+            self.log_test(name, False, error_msg, lines)
             return False, {}
         except Exception as e:
             error_msg = f"Request error: {str(e)}"
-            print(f"   💥 {error_msg}")
-            self.log_test(name, False, error_msg)
+            lines.append(f"   💥 {error_msg}")
+            self.log_test(name, False, error_msg, lines)
             return False, {}
 
     def test_root_endpoint(self):
@@ -101,10 +134,10 @@ class YouTubeAIProcessorTester:
             required_fields = ['id', 'url', 'transcript', 'timestamp']
             missing_fields = [field for field in required_fields if field not in response]
             if missing_fields:
-                print(f"   ⚠️  Missing fields in response: {missing_fields}")
+                self._print(f"   ⚠️  Missing fields in response: {missing_fields}")
                 self.log_test("Transcription Response Structure", False, f"Missing fields: {missing_fields}")
             else:
-                print(f"   📝 Transcript length: {len(response.get('transcript', ''))} characters")
+                self._print(f"   📝 Transcript length: {len(response.get('transcript', ''))} characters")
                 self.log_test("Transcription Response Structure", True, "All required fields present")
         
         return success, response
@@ -139,10 +172,10 @@ class YouTubeAIProcessorTester:
             required_fields = ['id', 'result', 'timestamp']
             missing_fields = [field for field in required_fields if field not in response]
             if missing_fields:
-                print(f"   ⚠️  Missing fields in response: {missing_fields}")
+                self._print(f"   ⚠️  Missing fields in response: {missing_fields}")
                 self.log_test("Summarization Response Structure", False, f"Missing fields: {missing_fields}")
             else:
-                print(f"   📄 Summary length: {len(response.get('result', ''))} characters")
+                self._print(f"   📄 Summary length: {len(response.get('result', ''))} characters")
                 self.log_test("Summarization Response Structure", True, "All required fields present")
         
         return success, response
@@ -177,10 +210,10 @@ class YouTubeAIProcessorTester:
             required_fields = ['id', 'result', 'timestamp']
             missing_fields = [field for field in required_fields if field not in response]
             if missing_fields:
-                print(f"   ⚠️  Missing fields in response: {missing_fields}")
+                self._print(f"   ⚠️  Missing fields in response: {missing_fields}")
                 self.log_test("Enrichment Response Structure", False, f"Missing fields: {missing_fields}")
             else:
-                print(f"   ✨ Enrichment length: {len(response.get('result', ''))} characters")
+                self._print(f"   ✨ Enrichment length: {len(response.get('result', ''))} characters")
                 self.log_test("Enrichment Response Structure", True, "All required fields present")
         
         return success, response
@@ -206,17 +239,17 @@ class YouTubeAIProcessorTester:
         )
         
         if success and isinstance(response, list):
-            print(f"   📊 Found {len(response)} videos in database")
+            self._print(f"   📊 Found {len(response)} videos in database")
             self.log_test("Videos List Structure", True, f"Returned {len(response)} videos")
         elif success:
-            print(f"   ⚠️  Expected list, got {type(response)}")
+            self._print(f"   ⚠️  Expected list, got {type(response)}")
             self.log_test("Videos List Structure", False, f"Expected list, got {type(response)}")
         
         return success
 
     def run_full_workflow_test(self):
         """Test the complete workflow: transcribe -> summarize -> enrich"""
-        print("\n🔄 Running Full Workflow Test...")
+        self._print("\n🔄 Running Full Workflow Test...")
         
         # Step 1: Transcribe
         transcribe_success, transcribe_response = self.test_transcribe_video()
@@ -250,32 +283,32 @@ def main():
     
     tester = YouTubeAIProcessorTester()
     
-    # Basic API tests
-    print("\n📡 Testing Basic API Endpoints...")
-    tester.test_root_endpoint()
-    
-    # Video processing tests
-    print("\n🎥 Testing Video Processing...")
-    tester.test_transcribe_invalid_url()  # Test error handling first
-    
-    # AI processing tests
-    print("\n🤖 Testing AI Processing...")
-    tester.test_summarize_empty_text()  # Test error handling
-    tester.test_enrich_empty_text()     # Test error handling
-    
     # Test with sample text (faster than full video)
     sample_text = "Este é um texto de exemplo para testar as funcionalidades de IA. Contém informações básicas que devem ser processadas pelo sistema de inteligência artificial para gerar resumos e aprimoramentos significativos."
-    tester.test_summarize_text(sample_text)
-    tester.test_enrich_text(sample_text)
-    
-    # Database tests
-    print("\n💾 Testing Database Operations...")
-    tester.test_get_videos()
     
-    # Full workflow test (this will take longer due to real YouTube transcription)
-    print("\n🔄 Testing Complete Workflow...")
-    print("⚠️  This test uses a real YouTube video and may take 1-2 minutes...")
-    tester.run_full_workflow_test()
+    # Basic API, error handling, AI processing and database tests are independent of each other
+    print("\n📡 Testing API endpoints, AI processing and database operations in parallel...")
+    independent_tests = [
+        (tester.test_root_endpoint, ()),
+        (tester.test_transcribe_invalid_url, ()),
+        (tester.test_summarize_empty_text, ()),
+        (tester.test_enrich_empty_text, ()),
+        (tester.test_summarize_text, (sample_text,)),
+        (tester.test_enrich_text, (sample_text,)),
+        (tester.test_get_videos, ()),
+    ]
+    try:
+        with ThreadPoolExecutor(max_workers=MAX_PARALLEL_TESTS) as executor:
+            futures = [executor.submit(test, *args) for test, args in independent_tests]
+            for future in futures:
+                future.result()
+        
+        # Full workflow test (this will take longer due to real YouTube transcription)
+        print("\n🔄 Testing Complete Workflow...")
+        print("⚠️  This test uses a real YouTube video and may take 1-2 minutes...")
+        tester.run_full_workflow_test()
+    finally:
+        tester.close_sessions()
     
     # Print final results
     print("\n" + "=" * 60)
@@ -286,8 +319,8 @@ def main():
     
     # Save detailed results
     results_file = "/app/test_reports/backend_test_results.json"
-    with open(results_file, 'w') as f:
-        json.dump({
+    with open(results_file, 'wb') as f:
+        f.write(orjson.dumps({
             "summary": {
                 "tests_run": tester.tests_run,
                 "tests_passed": tester.tests_passed,
@@ -295,7 +328,7 @@ def main():
                 "timestamp": datetime.now().isoformat()
             },
             "detailed_results": tester.test_results
-        }, f, indent=2)
+        }, option=orjson.OPT_INDENT_2))
     
     print(f"📄 Detailed results saved to: {results_file}")
     
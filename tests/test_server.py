@@ -0,0 +1,124 @@
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import server
+from server import extract_video_id, split_text
+
+VIDEO_ID = "dQw4w9WgXcQ"
+
+
+@pytest.mark.parametrize("url", [
+    f"https://www.youtube.com/watch?v={VIDEO_ID}",
+    f"https://youtube.com/watch?v={VIDEO_ID}&t=42s",
+    f"https://www.youtube.com/watch?feature=share&v={VIDEO_ID}",
+    f"https://m.youtube.com/watch?list=PL123&index=2&v={VIDEO_ID}#t=10",
+    f"https://youtu.be/{VIDEO_ID}",
+    f"https://youtu.be/{VIDEO_ID}?si=abc",
+    f"https://www.youtube.com/embed/{VIDEO_ID}",
+    f"https://www.youtube-nocookie.com/embed/{VIDEO_ID}",
+    f"https://www.youtube.com/v/{VIDEO_ID}",
+    f"https://www.youtube.com/shorts/{VIDEO_ID}",
+    f"https://www.youtube.com/live/{VIDEO_ID}?feature=shared",
+    VIDEO_ID,
+])
+def test_extract_video_id_accepts_known_forms(url):
+    assert extract_video_id(url) == VIDEO_ID
+
+
+@pytest.mark.parametrize("url", [
+    "https://invalid-url.com",
+    "invalid-url",
+    "not a url",
+    "",
+    f"https://www.youtube.com/watch?v={VIDEO_ID}x",
+    f"https://youtu.be/{VIDEO_ID}-abc",
+    f"https://www.youtube.com/shorts/{VIDEO_ID[:10]}",
+    f"https://example.com/watch?v={VIDEO_ID}",
+])
+def test_extract_video_id_rejects_invalid_urls(url):
+    with pytest.raises(ValueError):
+        extract_video_id(url)
+
+
+def test_split_text_returns_short_text_whole():
+    assert split_text("Uma frase curta.", 100, 10) == ["Uma frase curta."]
+
+
+def test_split_text_cuts_at_sentence_end_with_overlap():
+    text = "Primeira frase aqui. Segunda frase mais longa que a janela."
+    chunks = split_text(text, 30, 5)
+    assert chunks[0] == "Primeira frase aqui."
+    assert chunks[1].startswith(text[len(chunks[0]) - 5:len(chunks[0])])
+    assert text.endswith(chunks[-1])
+
+
+def test_split_text_without_sentence_end_uses_fixed_windows():
+    text = "a" * 100
+    chunks = split_text(text, 40, 10)
+    assert [len(chunk) for chunk in chunks] == [40, 40, 40]
+    assert "".join(chunk[10:] if i else chunk for i, chunk in enumerate(chunks)) == text
+
+
+def test_split_text_windows_cover_the_whole_text():
+    text = " ".join(f"Frase numero {i}." for i in range(200))
+    chunks = split_text(text, 120, 20)
+    assert all(len(chunk) <= 120 for chunk in chunks)
+    rebuilt = chunks[0]
+    for chunk in chunks[1:]:
+        assert rebuilt.endswith(chunk[:20])
+        rebuilt += chunk[20:]
+    assert rebuilt == text
+
+
+@pytest.mark.parametrize("overlap_chars", [20, 30, 40])
+def test_split_text_rejects_overlap_that_would_not_advance(overlap_chars):
+    text = "Frase curta. " * 20
+    with pytest.raises(ValueError):
+        split_text(text, 40, overlap_chars)
+
+
+def test_rate_limit_refuses_whole_cost_without_charging():
+    client_id = "test-cost-client"
+    server._rate_windows.pop(client_id, None)
+    server._check_rate_limit_memory(client_id, 0.0, server.MAX_REQUESTS_PER_HOUR - 1)
+
+    with pytest.raises(HTTPException) as refused:
+        server._check_rate_limit_memory(client_id, 0.0, 2)
+    assert refused.value.status_code == 429
+
+    server._check_rate_limit_memory(client_id, 0.0, 1)
+    assert len(server._rate_windows[client_id]) == server.MAX_REQUESTS_PER_HOUR
+
+
+class _StaleVideos:
+    """Coleção `videos` com um documento antigo: fora da janela de cache, mas com id já entregue."""
+
+    async def find_one(self, query, projection=None):
+        if "timestamp" in query:
+            return None
+        return {"id": "stored-id"}
+
+
+class _StaleDb:
+    videos = _StaleVideos()
+
+
+def test_stale_refresh_keeps_stored_id(monkeypatch):
+    async def fake_transcript(video_id, db):
+        return "Transcrição nova."
+
+    monkeypatch.setattr(server, "get_youtube_transcript", fake_transcript)
+    monkeypatch.setattr(server.app.state, "db", _StaleDb(), raising=False)
+    while not server.WRITE_QUEUE.empty():
+        server.WRITE_QUEUE.get_nowait()
+
+    response = TestClient(server.app).post("/api/videos/transcribe", json={"url": VIDEO_ID})
+
+    assert response.status_code == 200
+    assert response.json()["id"] == "stored-id"
+    collection, operation = server.WRITE_QUEUE.get_nowait()
+    assert collection == "videos"
+    assert "id" not in operation._doc["$set"]
+    assert operation._doc["$setOnInsert"] == {"id": "stored-id"}
+    assert operation._doc["$unset"] == {"summary": "", "enrichment": ""}